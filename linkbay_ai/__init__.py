@@ -27,7 +27,18 @@ from .schemas import (
 from .cost_controller import CostController, BudgetExceededException
 from .semantic_cache import SemanticCache
 from .conversation import ConversationContext
-from .tools import ToolsManager, CommonTools, create_default_tools_manager, ToolExecutionError, ToolValidationError, ToolNotFoundError
+from .tools import (
+    ToolsManager,
+    CommonTools,
+    create_default_tools_manager,
+    get_default_tools_manager,
+    ToolExecutionError,
+    ToolValidationError,
+    ToolNotFoundError,
+    setup_async_logging,
+    shutdown_async_logging,
+    configure_default_executor
+)
 from .prompt_library import PromptLibrary
 from .utils import (
     generate_html_tailwind,
@@ -72,9 +83,13 @@ __all__ = [
     "ToolsManager",
     "CommonTools",
     "create_default_tools_manager",
+    "get_default_tools_manager",
     "ToolExecutionError",
     "ToolValidationError",
     "ToolNotFoundError",
+    "setup_async_logging",
+    "shutdown_async_logging",
+    "configure_default_executor",
     "PromptLibrary",
     
     # Utils (legacy)
@@ -1,8 +1,9 @@
 """
 Conversation Context - Gestione conversazioni multi-turn
 """
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 from .schemas import Message, ConversationConfig
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,6 +18,25 @@ class ConversationContext:
         self.config = config or ConversationConfig()
         self.history: List[Message] = []
         self.total_tokens = 0
+
+        # Payload API mantenuto incrementalmente in parallelo alla history:
+        # i provider lo consumano senza ricostruire N dict per richiesta
+        self._api_messages: List[dict] = []
+
+        # Riassunto in background: il summarizer è iniettato (async str -> str)
+        # così il turno che supera la soglia non paga la latenza della LLM call
+        self._summarizer: Optional[Callable[[str], Awaitable[str]]] = None
+        self._summary_task: Optional[asyncio.Task] = None
+        self._summary_lock = asyncio.Lock()
+
+    def set_summarizer(self, summarizer: Callable[[str], Awaitable[str]]):
+        """
+        Imposta la funzione async che riassume i messaggi vecchi
+
+        Args:
+            summarizer: Callable async (testo) -> riassunto
+        """
+        self._summarizer = summarizer
     
     def add_message(self, role: str, content: str, tokens: Optional[int] = None):
         """
@@ -29,7 +49,8 @@ class ConversationContext:
         """
         message = Message(role=role, content=content, tokens=tokens)
         self.history.append(message)
-        
+        self._api_messages.append({"role": role, "content": content})
+
         if tokens:
             self.total_tokens += tokens
         
@@ -43,13 +64,68 @@ class ConversationContext:
         # Rimuovi messaggi vecchi se troppi
         while len(self.history) > self.config.max_messages:
             removed = self.history.pop(0)
+            self._api_messages.pop(0)
             if removed.tokens:
                 self.total_tokens -= removed.tokens
             logger.debug(f"🗑️ Rimosso messaggio vecchio dalla history")
         
-        # Se abilitato, riassumi messaggi vecchi quando vicini al limite
+        # Se abilitato, riassumi messaggi vecchi quando vicini al limite:
+        # il task gira in background, la richiesta corrente non aspetta
         if self.config.summarize_old_messages and len(self.history) > self.config.max_messages * 0.8:
+            self._schedule_summary()
+
+    def _schedule_summary(self):
+        """Avvia il task di riassunto in background se possibile"""
+        if self._summarizer is None:
             logger.info("📝 Potrebbe essere necessario riassumere messaggi vecchi")
+            return
+
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Nessun event loop attivo (uso sincrono): salta
+            return
+
+        self._summary_task = loop.create_task(self._summarize_old_messages())
+
+    async def _summarize_old_messages(self):
+        """Riassumi i messaggi vecchi e sostituiscili con un messaggio sintetico"""
+        keep_recent = max(1, self.config.max_messages // 2)
+
+        async with self._summary_lock:
+            old = self.history[:-keep_recent]
+            if not old:
+                return
+
+            text = "\n".join(f"{m.role}: {m.content}" for m in old)
+
+            try:
+                summary = await self._summarizer(text)
+            except Exception as e:
+                logger.warning(f"⚠️ Riassunto in background fallito: {e}")
+                return
+
+            # Rimuovi per identità i soli messaggi catturati nel
+            # riassunto: durante l'await la finestra può aver già
+            # espulso parte di old o accodato turni nuovi, e un taglio
+            # per conteggio eliminerebbe messaggi mai riassunti
+            old_ids = {id(m) for m in old}
+            removed_tokens = sum(
+                m.tokens or 0 for m in self.history if id(m) in old_ids
+            )
+            summary_msg = Message(role="system", content=f"[Riassunto: {summary}]")
+            self.history = [summary_msg] + [
+                m for m in self.history if id(m) not in old_ids
+            ]
+            self._api_messages = [
+                {"role": m.role, "content": m.content} for m in self.history
+            ]
+            self.total_tokens -= removed_tokens
+
+            logger.info(f"📝 Riassunti {len(old)} messaggi vecchi in background")
     
     def get_messages(self, last_n: Optional[int] = None) -> List[Message]:
         """
@@ -68,19 +144,26 @@ class ConversationContext:
     def get_context_for_api(self) -> List[dict]:
         """
         Ottieni i messaggi in formato API
-        
+
         Returns:
-            Lista di dict nel formato {role, content}
+            Lista di dict nel formato {role, content} (cache incrementale,
+            nessuna ricostruzione per chiamata)
         """
-        return [
-            {"role": msg.role, "content": msg.content}
-            for msg in self.history
-        ]
+        # Copia shallow: i dict restano condivisi ma la lista interna
+        # non è mutabile dal chiamante (resterebbe desincronizzata
+        # dalla history)
+        return list(self._api_messages)
     
     def clear(self):
         """Svuota la conversazione"""
         self.history.clear()
+        self._api_messages.clear()
         self.total_tokens = 0
+
+        if self._summary_task is not None and not self._summary_task.done():
+            self._summary_task.cancel()
+        self._summary_task = None
+
         logger.info("🗑️ Conversazione svuotata")
     
     def get_stats(self) -> dict:
@@ -103,4 +186,5 @@ class ConversationContext:
         """Aggiungi un system prompt all'inizio della conversazione"""
         system_msg = Message(role="system", content=prompt)
         self.history.insert(0, system_msg)
+        self._api_messages.insert(0, {"role": "system", "content": prompt})
         logger.debug("🎯 System prompt aggiunto")
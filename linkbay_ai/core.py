@@ -8,10 +8,70 @@ from .semantic_cache import SemanticCache
 from .conversation import ConversationContext
 from .tools import ToolsManager, create_default_tools_manager
 from typing import Dict, Any, List, Optional, AsyncIterator
+from collections import Counter, deque
+import asyncio
+import functools
+import hashlib
+import heapq
 import logging
+import re
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Tokenizer Rust (HuggingFace tokenizers) opzionale per stime accurate;
+# senza, si usa l'euristica parole*2
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+# Caricato in un thread one-shot al primo uso: from_pretrained può
+# scaricare dal HuggingFace Hub e non deve bloccare né l'import del
+# pacchetto né l'event loop. Finché il caricamento non è concluso si
+# usa l'euristica
+_TOKENIZER = None
+_TOKENIZER_STARTED = False
+
+
+def _load_tokenizer():
+    """Carica il tokenizer (eseguito su thread dedicato, un tentativo)"""
+    global _TOKENIZER
+    try:
+        _TOKENIZER = Tokenizer.from_pretrained("deepseek-ai/deepseek-coder")
+    except Exception:
+        _TOKENIZER = None
+
+
+def _get_tokenizer():
+    """Avvia il caricamento in background al primo uso, senza attenderlo"""
+    global _TOKENIZER_STARTED
+    if not _TOKENIZER_STARTED:
+        _TOKENIZER_STARTED = True
+        if Tokenizer is not None:
+            threading.Thread(
+                target=_load_tokenizer, name="linkbay-tokenizer", daemon=True
+            ).start()
+    return _TOKENIZER
+
+
+def _estimate_tokens(prompt: str) -> int:
+    """Stima i token di un prompt"""
+    if _get_tokenizer() is not None:
+        return _estimate_tokens_tokenized(prompt)
+    return len(prompt.split()) * 2  # Stima approssimativa
+
+
+@functools.lru_cache(maxsize=4096)
+def _estimate_tokens_tokenized(prompt: str) -> int:
+    """Conteggio esatto via tokenizer (memoizzato sui prompt identici)"""
+    return len(_TOKENIZER.encode(prompt).ids)
+
+# Prompt "matematici" (numeri lunghi, formule, richieste di calcolo):
+# un falso hit qui costa più di 20 hit legittimi, quindi bypass cache
+_CACHE_BYPASS_RE = re.compile(r"\d{3,}|=|\bcalcola\b|\bcalculate\b")
+
 class AllProvidersFailedException(Exception):
     """Eccezione quando tutti i provider falliscono"""
     pass
@@ -27,7 +87,16 @@ class AIOrchestrator:
     - Tool/function calling
     - Smart routing
     """
-    
+
+    # Secondi di cooldown del circuit breaker dopo un fallimento
+    CIRCUIT_COOLDOWN = 30.0
+
+    # Dimensione massima della cache L1 exact-match
+    L1_MAX_ENTRIES = 4096
+
+    # Capienza della request history (eviction automatica FIFO)
+    HISTORY_MAX_ENTRIES = 10_000
+
     def __init__(
         self,
         budget_config: Optional[BudgetConfig] = None,
@@ -38,16 +107,36 @@ class AIOrchestrator:
         # Provider management
         self.providers: List[BaseProvider] = []
         self.provider_priority: Dict[str, int] = {}
+
+        # Heap ordinato per (priorità, failure_score) + stato circuit breaker
+        self._provider_heap: List[List] = []
+        self._heap_entries: Dict[str, List] = {}
+        self._providers_by_name: Dict[str, BaseProvider] = {}
+        self._failure_scores: Dict[str, int] = {}
+        self._circuit_open_until: Dict[str, float] = {}
+
+        # Tupla ordinata cachata: ricostruita solo quando cambia
+        # l'heap (registrazione o variazione di failure score)
+        self._ordered_providers: Optional[tuple] = None
         
         # Feature modules
         self.cost_controller = CostController(budget_config or BudgetConfig())
         self.semantic_cache = SemanticCache() if enable_cache else None
+
+        # Cache L1 exact-match: hash(namespace|prompt) -> risposta.
+        # Costa zero embedding e copre i prompt ripetuti identici
+        self._l1_cache: Dict[bytes, str] = {}
         self.conversation = ConversationContext(conversation_config)
         self.tools_manager = create_default_tools_manager() if enable_tools else None
         
-        # Analytics
-        self.request_history: List[Dict] = []
+        # Analytics: contatori incrementali, niente rescan della history.
+        # La history è un deque limitato di tuple compatte
+        # (prompt, model, provider, tokens, cached)
+        self.request_history: deque = deque(maxlen=self.HISTORY_MAX_ENTRIES)
         self.provider_stats: Dict[str, Dict[str, int]] = {}
+        self._total_requests = 0
+        self._model_counts: Counter = Counter()
+        self._model_tokens: Counter = Counter()
         
         logger.info("🚀 AIOrchestrator inizializzato")
     
@@ -61,10 +150,19 @@ class AIOrchestrator:
         """
         self.providers.append(provider)
         self.provider_priority[provider.name] = priority
-        
+
         # Ordina per priorità
         self.providers.sort(key=lambda p: self.provider_priority[p.name])
-        
+
+        # Inserisci nell'heap (priorità, failure_score, nome) e resetta il circuito
+        entry = [priority, 0, provider.name]
+        self._heap_entries[provider.name] = entry
+        heapq.heappush(self._provider_heap, entry)
+        self._providers_by_name[provider.name] = provider
+        self._failure_scores[provider.name] = 0
+        self._circuit_open_until.pop(provider.name, None)
+        self._ordered_providers = None
+
         # Inizializza stats
         if provider.name not in self.provider_stats:
             self.provider_stats[provider.name] = {
@@ -98,41 +196,63 @@ class AIOrchestrator:
         Returns:
             AIResponse con la risposta
         """
-        # 1. Controlla cache
-        if use_cache and self.semantic_cache:
-            cached = await self.semantic_cache.get_cached_response(prompt)
+        # 1. Smart routing del modello (serve anche per la chiave di cache)
+        if not model:
+            model = self._smart_route_model(prompt)
+
+        # 2. Controlla cache (namespace = modello + tool attivi,
+        #    bypass per prompt matematici)
+        use_cache = use_cache and self.semantic_cache and not _CACHE_BYPASS_RE.search(prompt)
+        cache_namespace = self._cache_namespace(model, use_tools) if use_cache else ""
+        l1_key = self._l1_key(cache_namespace, prompt) if use_cache else b""
+
+        if use_cache:
+            # L1: exact-match, nessun embedding calcolato
+            cached = self._l1_cache.get(l1_key)
+
+            # L2: lookup semantico, con backfill della L1 sul hit
+            if cached is None:
+                cached = await self.semantic_cache.get_cached_response(
+                    prompt, namespace=cache_namespace
+                )
+                if cached is not None:
+                    self._l1_store(l1_key, cached)
+
             if cached:
-                return AIResponse(
+                # Contenuto interno già validato: niente re-validazione
+                return AIResponse.model_construct(
                     content=cached,
                     model="cached",
                     provider="cache",
-                    cached=True
+                    tokens_used=0,
+                    cached=True,
+                    tool_calls=None
                 )
-        
-        # 2. Aggiungi a conversation context
+
+        # 3. Aggiungi a conversation context (payload API cachato)
         if use_conversation:
             self.conversation.add_message("user", prompt)
-            messages = self.conversation.get_messages()
+            messages = self.conversation.get_context_for_api()
         else:
-            messages = [Message(role="user", content=prompt)]
-        
-        # 3. Smart routing del modello
-        if not model:
-            model = self._smart_route_model(prompt)
-        
+            messages = [{"role": "user", "content": prompt}]
+
         # 4. Stima token e controlla budget
-        estimated_tokens = len(prompt.split()) * 2  # Stima approssimativa
+        estimated_tokens = _estimate_tokens(prompt)
         try:
             await self.cost_controller.check_budget(estimated_tokens, model)
         except BudgetExceededException as e:
             logger.error(f"💰 {str(e)}")
             raise
         
-        # 5. Prepara parametri
-        params = GenerationParams(model=model)
-        if use_tools and self.tools_manager:
-            params.tools = self.tools_manager.get_tool_definitions()
-        
+        # 5. Prepara parametri (GenerationParams è frozen: tools alla costruzione)
+        params = GenerationParams(
+            model=model,
+            tools=(
+                self.tools_manager.get_tool_definitions()
+                if use_tools and self.tools_manager else None
+            )
+        )
+
         # 6. Esegui con fallback multi-provider
         response = await self._execute_with_fallback(messages, params, max_retries)
         
@@ -142,7 +262,7 @@ class AIOrchestrator:
             # Aggiungi risultato tool e richiama API
             self.conversation.add_message("assistant", response.content or "")
             self.conversation.add_message("system", f"Tool result: {tool_result}")
-            messages = self.conversation.get_messages()
+            messages = self.conversation.get_context_for_api()
             response = await self._execute_with_fallback(messages, params, max_retries)
         
         # 8. Aggiorna conversazione
@@ -153,21 +273,23 @@ class AIOrchestrator:
                 tokens=response.tokens_used
             )
         
-        # 9. Salva in cache
-        if use_cache and self.semantic_cache and not response.cached:
-            await self.semantic_cache.cache_response(prompt, response.content)
+        # 9. Salva in cache (L1 + L2)
+        if use_cache and not response.cached:
+            self._l1_store(l1_key, response.content)
+            await self.semantic_cache.cache_response(
+                prompt, response.content, namespace=cache_namespace
+            )
         
         # 10. Registra utilizzo
         self.cost_controller.record_usage(response.tokens_used, model)
         
         # 11. Analytics
-        self.request_history.append({
-            "prompt": prompt,
-            "model": model,
-            "provider": response.provider,
-            "tokens": response.tokens_used,
-            "cached": response.cached
-        })
+        self._total_requests += 1
+        self._model_counts[model] += 1
+        self._model_tokens[model] += response.tokens_used
+        self.request_history.append(
+            (prompt, model, response.provider, response.tokens_used, response.cached)
+        )
         
         return response
     
@@ -175,56 +297,165 @@ class AIOrchestrator:
         self,
         prompt: str,
         model: Optional[str] = None,
-        use_conversation: bool = True
+        use_conversation: bool = True,
+        use_cache: bool = True,
+        temperature: float = 0.7
     ) -> AsyncIterator[str]:
         """
         Chat con streaming per UX migliore
-        
+
         Args:
             prompt: Prompt dell'utente
             model: Modello specifico
             use_conversation: Usa conversation context
-            
+            use_cache: Usa cache (solo per stream deterministici, temperature=0)
+            temperature: Temperatura di generazione
+
         Yields:
             Chunk di risposta
         """
+        if not model:
+            model = self._smart_route_model(prompt)
+
+        # Cache solo per stream deterministici: a temperature > 0 la stessa
+        # query produce output diversi e il replay mentirebbe
+        use_cache = (
+            use_cache and self.semantic_cache and temperature == 0
+            and not _CACHE_BYPASS_RE.search(prompt)
+        )
+        cache_namespace = self._cache_namespace(model, False) if use_cache else ""
+        l1_key = self._l1_key(cache_namespace, prompt) if use_cache else b""
+
+        if use_cache:
+            cached = self._l1_cache.get(l1_key)
+            if cached is None:
+                cached = await self.semantic_cache.get_cached_response(
+                    prompt, namespace=cache_namespace
+                )
+                if cached is not None:
+                    self._l1_store(l1_key, cached)
+
+            if cached:
+                if use_conversation:
+                    self.conversation.add_message("user", prompt)
+                    self.conversation.add_message("assistant", cached)
+                async for chunk in self._replay_cached(cached):
+                    yield chunk
+                return
+
         if use_conversation:
             self.conversation.add_message("user", prompt)
-            messages = self.conversation.get_messages()
+            messages = self.conversation.get_context_for_api()
         else:
-            messages = [Message(role="user", content=prompt)]
-        
-        if not model:
-            model = self._smart_route_model(prompt)
-        
-        params = GenerationParams(model=model)
-        
-        # Trova provider disponibile
-        for provider in self.providers:
+            messages = [{"role": "user", "content": prompt}]
+
+        params = GenerationParams(model=model, temperature=temperature)
+
+        # Trova provider disponibile (ordine heap + circuit breaker)
+        for provider in self._provider_candidates():
             if not provider.is_available():
                 continue
-            
+
             try:
                 full_response = []
                 async for chunk in provider.stream(messages, params):
                     full_response.append(chunk)
                     yield chunk
-                
+
+                self._record_provider_success(provider.name)
+
                 # Aggiorna conversazione con risposta completa
+                content = "".join(full_response)
                 if use_conversation:
-                    self.conversation.add_message("assistant", "".join(full_response))
-                
+                    self.conversation.add_message("assistant", content)
+
+                # EOF pulito: lo stream accumulato diventa cachabile
+                if use_cache and content:
+                    self._l1_store(l1_key, content)
+                    await self.semantic_cache.cache_response(
+                        prompt, content, namespace=cache_namespace
+                    )
+
                 return
-                
+
             except Exception as e:
                 logger.warning(f"⚠️ {provider.name} streaming failed: {e}")
+                self._record_provider_failure(provider.name)
                 continue
-        
+
         raise AllProvidersFailedException("Tutti i provider hanno fallito")
+
+    @staticmethod
+    async def _replay_cached(response: str, chunk_size: int = 40) -> AsyncIterator[str]:
+        """
+        Rigioca una risposta cachata a chunk per preservare la UX streaming
+
+        Args:
+            response: Risposta completa da rigiocare
+            chunk_size: Caratteri per chunk
+
+        Yields:
+            Chunk di risposta
+        """
+        for i in range(0, len(response), chunk_size):
+            yield response[i:i + chunk_size]
+            await asyncio.sleep(0.01)
+
+    def _provider_candidates(self) -> List[BaseProvider]:
+        """
+        Ottieni i provider in ordine (priorità, failure_score),
+        saltando quelli con circuit breaker aperto
+
+        Returns:
+            Lista di provider candidati
+        """
+        if self._ordered_providers is None:
+            self._ordered_providers = tuple(
+                self._providers_by_name[name]
+                for _, _, name in heapq.nsmallest(
+                    len(self._provider_heap), self._provider_heap
+                )
+            )
+
+        now = time.monotonic()
+        candidates = []
+
+        for provider in self._ordered_providers:
+            if self._circuit_open_until.get(provider.name, 0.0) > now:
+                logger.warning(f"⛔ {provider.name} in cooldown (circuit aperto), skip")
+                continue
+            candidates.append(provider)
+
+        return candidates
+
+    def _record_provider_failure(self, name: str):
+        """Incrementa il failure score e apri il circuito per il cooldown"""
+        score = self._failure_scores.get(name, 0) + 1
+        self._failure_scores[name] = score
+
+        entry = self._heap_entries.get(name)
+        if entry is not None:
+            entry[1] = score
+            heapq.heapify(self._provider_heap)
+            self._ordered_providers = None
+
+        self._circuit_open_until[name] = time.monotonic() + self.CIRCUIT_COOLDOWN
+
+    def _record_provider_success(self, name: str):
+        """Resetta failure score e chiudi il circuito dopo un successo"""
+        if self._failure_scores.get(name):
+            self._failure_scores[name] = 0
+            entry = self._heap_entries.get(name)
+            if entry is not None:
+                entry[1] = 0
+                heapq.heapify(self._provider_heap)
+                self._ordered_providers = None
+
+        self._circuit_open_until.pop(name, None)
     
     async def _execute_with_fallback(
         self,
-        messages: List[Message],
+        messages: List[Dict[str, str]],
         params: GenerationParams,
         max_retries: int
     ) -> AIResponse:
@@ -232,35 +463,37 @@ class AIOrchestrator:
         
         if not self.providers:
             raise ValueError("Nessun provider configurato")
-        
-        for provider in self.providers:
+
+        for provider in self._provider_candidates():
             # Salta provider non disponibili
             if not provider.is_available():
                 logger.warning(f"⚠️ {provider.name} non disponibile, skip")
                 continue
-            
+
             stats = self.provider_stats[provider.name]
-            
+
             for attempt in range(max_retries):
                 try:
                     stats["requests"] += 1
                     logger.info(f"🔄 Tentativo {attempt + 1}/{max_retries} con {provider.name}")
-                    
+
                     response = await provider.chat(messages, params)
-                    
+
                     stats["successes"] += 1
+                    self._record_provider_success(provider.name)
                     logger.info(f"✅ Successo con {provider.name}")
-                    
+
                     return response
-                    
+
                 except Exception as e:
                     stats["failures"] += 1
                     logger.warning(f"❌ {provider.name} fallito (tentativo {attempt + 1}): {e}")
-                    
+
                     if attempt < max_retries - 1:
                         continue
                     else:
                         logger.error(f"💥 {provider.name} fallito dopo {max_retries} tentativi")
+                        self._record_provider_failure(provider.name)
                         break
         
         # Tutti i provider hanno fallito
@@ -273,14 +506,51 @@ class AIOrchestrator:
         if not self.tools_manager:
             return None
         
-        results = []
-        for tc in tool_calls:
-            tool_call = ToolCall(name=tc["name"], arguments=tc["arguments"])
-            result = await self.tools_manager.execute_tool(tool_call)
-            results.append(result)
-        
-        return results
+        # Dati già validati dal provider: model_construct salta
+        # i validator pydantic sul percorso caldo
+        calls = [
+            ToolCall.model_construct(name=tc["name"], arguments=tc["arguments"])
+            for tc in tool_calls
+        ]
+
+        # Esecuzione parallela: le latenze dei tool si sovrappongono
+        return await self.tools_manager.execute_tools(calls)
     
+    @staticmethod
+    def _l1_key(namespace: str, prompt: str) -> bytes:
+        """Chiave L1 exact-match: hash di namespace + prompt"""
+        return hashlib.blake2b(
+            f"{namespace}|{prompt}".encode(), digest_size=16
+        ).digest()
+
+    def _l1_store(self, key: bytes, response: str):
+        """Salva in L1 con eviction FIFO oltre la capienza massima"""
+        if len(self._l1_cache) >= self.L1_MAX_ENTRIES:
+            self._l1_cache.pop(next(iter(self._l1_cache)))
+        self._l1_cache[key] = response
+
+    def _cache_namespace(self, model: str, use_tools: bool) -> str:
+        """
+        Calcola il namespace di cache per modello + tool set attivo,
+        così modelli o tool set diversi non collidono mai
+
+        Args:
+            model: Modello in uso
+            use_tools: Se il function calling è abilitato
+
+        Returns:
+            Chiave di namespace "modello|tool_hash"
+        """
+        if use_tools and self.tools_manager:
+            tool_names = "|".join(sorted(self.tools_manager.list_tools()))
+            tool_hash = hashlib.blake2b(
+                tool_names.encode(), digest_size=8
+            ).hexdigest()
+        else:
+            tool_hash = "no-tools"
+
+        return f"{model}|{tool_hash}"
+
     def _smart_route_model(self, prompt: str) -> str:
         """
         Smart routing: seleziona il modello migliore in base al prompt
@@ -318,10 +588,30 @@ class AIOrchestrator:
         logger.info("💬 Smart routing: deepseek-chat (default)")
         return "deepseek-chat"
     
+    def get_request_history(self) -> List[Dict[str, Any]]:
+        """
+        Ottieni la request history in formato dict (conversione solo in uscita)
+
+        Returns:
+            Lista di dict con prompt, model, provider, tokens, cached
+        """
+        return [
+            {
+                "prompt": prompt,
+                "model": model,
+                "provider": provider,
+                "tokens": tokens,
+                "cached": cached
+            }
+            for prompt, model, provider, tokens, cached in self.request_history
+        ]
+
     def get_analytics(self) -> Dict[str, Any]:
-        """Ottieni analytics complete"""
+        """Ottieni analytics complete (contatori O(1), nessuna scansione)"""
         return {
-            "total_requests": len(self.request_history),
+            "total_requests": self._total_requests,
+            "by_model": dict(self._model_counts),
+            "tokens_by_model": dict(self._model_tokens),
             "providers": self.provider_stats,
             "budget": self.cost_controller.get_current_usage(),
             "cache": self.semantic_cache.get_stats() if self.semantic_cache else None,
@@ -1,10 +1,11 @@
 """
 Cost Controller - Budget tracking e rate limiting
 """
-from typing import Dict, Optional
-from datetime import datetime, timedelta
+from typing import Dict
 from .schemas import BudgetConfig
 import logging
+import time
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -14,13 +15,31 @@ class BudgetExceededException(Exception):
 
 class CostController:
     """Controlla i costi e limita l'utilizzo dei token"""
-    
+
+    # Dimensioni dei ring buffer: 48 slot orari, 3 slot giornalieri
+    HOUR_SLOTS = 48
+    DAY_SLOTS = 3
+
+    # Intervallo minimo (secondi) tra due alert di budget
+    ALERT_INTERVAL = 60.0
+
     def __init__(self, config: BudgetConfig):
         self.config = config
-        self.hourly_usage: Dict[str, int] = {}  # timestamp_hour -> tokens
-        self.daily_usage: Dict[str, int] = {}   # timestamp_day -> tokens
-        self.hourly_cost: Dict[str, float] = {}
-        
+
+        # Ring buffer pre-allocati di contatori, indicizzati da
+        # (epoch // 3600) % HOUR_SLOTS e (epoch // 86400) % DAY_SLOTS.
+        # Niente chiavi stringa, niente strftime, cleanup O(gap).
+        self._tok_hr = np.zeros(self.HOUR_SLOTS, np.int64)
+        self._cost_hr = np.zeros(self.HOUR_SLOTS, np.float64)
+        self._tok_day = np.zeros(self.DAY_SLOTS, np.int64)
+
+        now_s = time.time()
+        self._last_hr_slot = int(now_s // 3600)
+        self._last_day_slot = int(now_s // 86400)
+
+        # Dedup degli alert su clock monotonico (il wall-clock può saltare)
+        self._last_alert_mono = 0.0
+
         # Prezzi per token (esempio - aggiusta in base al provider)
         self.token_costs = {
             "deepseek-chat": 0.14 / 1_000_000,      # $0.14 per 1M tokens
@@ -28,114 +47,147 @@ class CostController:
             "gpt-3.5-turbo": 0.5 / 1_000_000,
             "gpt-4": 30.0 / 1_000_000
         }
-    
-    def _get_hour_key(self) -> str:
-        """Ottieni chiave per l'ora corrente"""
-        return datetime.now().strftime("%Y-%m-%d-%H")
-    
-    def _get_day_key(self) -> str:
-        """Ottieni chiave per il giorno corrente"""
-        return datetime.now().strftime("%Y-%m-%d")
-    
-    def _cleanup_old_entries(self):
-        """Rimuovi entry vecchie per risparmiare memoria"""
-        now = datetime.now()
-        hour_threshold = (now - timedelta(hours=2)).strftime("%Y-%m-%d-%H")
-        day_threshold = (now - timedelta(days=2)).strftime("%Y-%m-%d")
-        
-        # Cleanup hourly
-        self.hourly_usage = {k: v for k, v in self.hourly_usage.items() if k > hour_threshold}
-        self.hourly_cost = {k: v for k, v in self.hourly_cost.items() if k > hour_threshold}
-        
-        # Cleanup daily
-        self.daily_usage = {k: v for k, v in self.daily_usage.items() if k > day_threshold}
-    
+
+        # Tabella costi materializzata: indice per modello + array float64,
+        # ultimo slot = costo di default per modelli sconosciuti
+        self._model_idx: Dict[str, int] = {
+            model: i for i, model in enumerate(self.token_costs)
+        }
+        self._default_idx = len(self.token_costs)
+        self._costs = np.array(
+            list(self.token_costs.values()) + [0.001], dtype=np.float64
+        )
+
+    def _cost(self, model: str, tokens: int) -> float:
+        """Calcola il costo in USD per un numero di token sul modello dato"""
+        return tokens * self._costs[self._model_idx.get(model, self._default_idx)]
+
+    def _advance(self, now_s: float):
+        """
+        Azzera gli slot scaduti e ritorna gli indici correnti
+
+        Args:
+            now_s: Timestamp epoch in secondi
+
+        Returns:
+            Tupla (indice_slot_orario, indice_slot_giornaliero)
+        """
+        hr_slot = int(now_s // 3600)
+        gap = hr_slot - self._last_hr_slot
+        if gap > 0:
+            if gap >= self.HOUR_SLOTS:
+                self._tok_hr[:] = 0
+                self._cost_hr[:] = 0
+            else:
+                for s in range(self._last_hr_slot + 1, hr_slot + 1):
+                    idx = s % self.HOUR_SLOTS
+                    self._tok_hr[idx] = 0
+                    self._cost_hr[idx] = 0
+            self._last_hr_slot = hr_slot
+
+        day_slot = int(now_s // 86400)
+        gap = day_slot - self._last_day_slot
+        if gap > 0:
+            if gap >= self.DAY_SLOTS:
+                self._tok_day[:] = 0
+            else:
+                for s in range(self._last_day_slot + 1, day_slot + 1):
+                    self._tok_day[s % self.DAY_SLOTS] = 0
+            self._last_day_slot = day_slot
+
+        return hr_slot % self.HOUR_SLOTS, day_slot % self.DAY_SLOTS
+
     async def check_budget(self, estimated_tokens: int, model: str = "deepseek-chat") -> bool:
         """
         Verifica se c'è budget disponibile
-        
+
         Args:
             estimated_tokens: Token stimati per la richiesta
             model: Modello da utilizzare
-            
+
         Returns:
             True se c'è budget disponibile
-            
+
         Raises:
             BudgetExceededException: Se il budget è stato superato
             ValueError: Se i parametri non sono validi
         """
+        # Limiti in locali: evita attribute load ripetuti nel percorso caldo
+        max_hourly = self.config.max_tokens_per_hour
+        max_daily = self.config.max_tokens_per_day
+        max_cost = self.config.max_cost_per_hour
+
         if estimated_tokens < 0:
             raise ValueError("estimated_tokens deve essere positivo")
-        if estimated_tokens > self.config.max_tokens_per_hour:
-            raise ValueError(f"Richiesta supera il limite orario massimo ({self.config.max_tokens_per_hour})")
-        
-        self._cleanup_old_entries()
-        
-        hour_key = self._get_hour_key()
-        day_key = self._get_day_key()
-        
+        if estimated_tokens > max_hourly:
+            raise ValueError(f"Richiesta supera il limite orario massimo ({max_hourly})")
+
+        # Un solo timestamp per richiesta: tutti gli slot derivano da qui
+        now_s = time.time()
+        hr_idx, day_idx = self._advance(now_s)
+
         # Controlla token orari
-        current_hourly = self.hourly_usage.get(hour_key, 0)
-        if current_hourly + estimated_tokens > self.config.max_tokens_per_hour:
+        current_hourly = int(self._tok_hr[hr_idx])
+        if current_hourly + estimated_tokens > max_hourly:
             raise BudgetExceededException(
-                f"Budget orario superato: {current_hourly + estimated_tokens} / {self.config.max_tokens_per_hour}"
+                f"Budget orario superato: {current_hourly + estimated_tokens} / {max_hourly}"
             )
-        
+
         # Controlla token giornalieri
-        current_daily = self.daily_usage.get(day_key, 0)
-        if current_daily + estimated_tokens > self.config.max_tokens_per_day:
+        current_daily = int(self._tok_day[day_idx])
+        if current_daily + estimated_tokens > max_daily:
             raise BudgetExceededException(
-                f"Budget giornaliero superato: {current_daily + estimated_tokens} / {self.config.max_tokens_per_day}"
+                f"Budget giornaliero superato: {current_daily + estimated_tokens} / {max_daily}"
             )
-        
+
         # Controlla costi orari
-        estimated_cost = estimated_tokens * self.token_costs.get(model, 0.001)
-        current_cost = self.hourly_cost.get(hour_key, 0.0)
-        if current_cost + estimated_cost > self.config.max_cost_per_hour:
+        estimated_cost = self._cost(model, estimated_tokens)
+        current_cost = float(self._cost_hr[hr_idx])
+        if current_cost + estimated_cost > max_cost:
             raise BudgetExceededException(
-                f"Budget costi orario superato: ${current_cost + estimated_cost:.4f} / ${self.config.max_cost_per_hour}"
+                f"Budget costi orario superato: ${current_cost + estimated_cost:.4f} / ${max_cost}"
             )
-        
-        # Alert se vicino al limite
-        hourly_percent = (current_hourly + estimated_tokens) / self.config.max_tokens_per_hour
+
+        # Alert se vicino al limite (dedup su clock monotonico)
+        hourly_percent = (current_hourly + estimated_tokens) / max_hourly
         if hourly_percent > self.config.alert_threshold:
-            logger.warning(
-                f"⚠️ Budget alert: utilizzo al {hourly_percent * 100:.1f}% del limite orario"
-            )
-        
+            now_mono = time.monotonic()
+            if now_mono - self._last_alert_mono >= self.ALERT_INTERVAL:
+                self._last_alert_mono = now_mono
+                logger.warning(
+                    f"⚠️ Budget alert: utilizzo al {hourly_percent * 100:.1f}% del limite orario"
+                )
+
         return True
-    
+
     def record_usage(self, tokens_used: int, model: str = "deepseek-chat"):
         """
         Registra l'utilizzo effettivo
-        
+
         Args:
             tokens_used: Token utilizzati
             model: Modello utilizzato
         """
-        hour_key = self._get_hour_key()
-        day_key = self._get_day_key()
-        
+        hr_idx, day_idx = self._advance(time.time())
+
         # Aggiorna contatori
-        self.hourly_usage[hour_key] = self.hourly_usage.get(hour_key, 0) + tokens_used
-        self.daily_usage[day_key] = self.daily_usage.get(day_key, 0) + tokens_used
-        
+        self._tok_hr[hr_idx] += tokens_used
+        self._tok_day[day_idx] += tokens_used
+
         # Aggiorna costi
-        cost = tokens_used * self.token_costs.get(model, 0.001)
-        self.hourly_cost[hour_key] = self.hourly_cost.get(hour_key, 0.0) + cost
-        
+        cost = self._cost(model, tokens_used)
+        self._cost_hr[hr_idx] += cost
+
         logger.info(f"📊 Token utilizzati: {tokens_used} | Costo: ${cost:.4f} | Modello: {model}")
-    
+
     def get_current_usage(self) -> Dict[str, any]:
         """Ottieni statistiche di utilizzo correnti"""
-        hour_key = self._get_hour_key()
-        day_key = self._get_day_key()
-        
-        hourly_tokens = self.hourly_usage.get(hour_key, 0)
-        daily_tokens = self.daily_usage.get(day_key, 0)
-        hourly_cost = self.hourly_cost.get(hour_key, 0.0)
-        
+        hr_idx, day_idx = self._advance(time.time())
+
+        hourly_tokens = int(self._tok_hr[hr_idx])
+        daily_tokens = int(self._tok_day[day_idx])
+        hourly_cost = float(self._cost_hr[hr_idx])
+
         return {
             "hourly": {
                 "tokens": hourly_tokens,
@@ -150,10 +202,10 @@ class CostController:
                 "percent": (daily_tokens / self.config.max_tokens_per_day) * 100
             }
         }
-    
+
     def reset_budgets(self):
         """Reset manuale dei budget (admin only)"""
-        self.hourly_usage.clear()
-        self.daily_usage.clear()
-        self.hourly_cost.clear()
+        self._tok_hr[:] = 0
+        self._cost_hr[:] = 0
+        self._tok_day[:] = 0
         logger.warning("🔄 Budget reset effettuato")
@@ -1,12 +1,29 @@
-from openai import OpenAI, APIError, APIConnectionError, APITimeoutError, RateLimitError
+from openai import AsyncOpenAI, APIError, APIConnectionError, APITimeoutError, RateLimitError
 from .schemas import ProviderConfig, GenerationParams, AIResponse, Message, ProviderType
 from typing import Dict, Any, List, AsyncIterator, Optional
 from abc import ABC, abstractmethod
 import logging
 import asyncio
+import json
+
+# orjson (parser C SIMD-accelerato) è opzionale: fallback su stdlib
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 logger = logging.getLogger(__name__)
 
+def _to_api_messages(messages: List) -> List[Dict[str, str]]:
+    """
+    Converti i messaggi nel formato API OpenAI.
+    Pass-through se già dict (payload cachato da ConversationContext)
+    """
+    if messages and isinstance(messages[0], dict):
+        return messages
+    return [{"role": msg.role, "content": msg.content} for msg in messages]
+
 class ProviderError(Exception):
     """Errore generico del provider"""
     pass
@@ -23,12 +40,25 @@ class ProviderConnectionError(ProviderError):
     """Errore di connessione con il provider"""
     pass
 
+# Mappa eccezione OpenAI -> eccezione provider ritentabile:
+# un solo ramo except invece di tre quasi identici
+_RETRYABLE_EXC = {
+    RateLimitError: ProviderRateLimitError,
+    APITimeoutError: ProviderTimeoutError,
+    APIConnectionError: ProviderConnectionError,
+}
+
 class BaseProvider(ABC):
     """Base class per tutti i provider AI"""
-    
+
+    # Dimensione della coda tra il reader HTTP e il consumer dello stream
+    STREAM_QUEUE_SIZE = 64
+
     def __init__(self, config: ProviderConfig):
         self.config = config
         self.name = config.provider_type.value
+        self.request_count = 0
+        self.error_count = 0
     
     @abstractmethod
     async def chat(self, messages: List[Message], params: GenerationParams = None) -> AIResponse:
@@ -67,42 +97,75 @@ class BaseProvider(ABC):
         Raises:
             ProviderError: Se tutti i tentativi falliscono
         """
+        # Backoff precomputati: nessuna potenza ricalcolata nei rami except
+        backoffs = tuple(backoff_factor * (2 ** i) for i in range(max_retries))
         last_exception = None
-        
+
         for attempt in range(max_retries):
             try:
                 self.request_count += 1
-                result = await func() if asyncio.iscoroutinefunction(func) else func()
-                return result
-            except RateLimitError as e:
-                last_exception = ProviderRateLimitError(f"Rate limit error: {e}")
-                wait_time = (2 ** attempt) * backoff_factor
-                logger.warning(f"⚠️ Rate limit colpito, retry in {wait_time}s...")
-                await asyncio.sleep(wait_time)
-            except APITimeoutError as e:
-                last_exception = ProviderTimeoutError(f"Timeout: {e}")
-                logger.warning(f"⏱️ Timeout, retry {attempt + 1}/{max_retries}...")
-                await asyncio.sleep(2 ** attempt)
-            except APIConnectionError as e:
-                last_exception = ProviderConnectionError(f"Connection error: {e}")
-                logger.warning(f"🔌 Errore connessione, retry {attempt + 1}/{max_retries}...")
-                await asyncio.sleep(2 ** attempt)
-            except APIError as e:
-                # Non ritentare per errori di validazione (4xx)
-                if hasattr(e, 'status_code') and 400 <= e.status_code < 500:
-                    raise ProviderError(f"Client error: {e}")
-                last_exception = ProviderError(f"API error: {e}")
-                logger.warning(f"❌ Errore API, retry {attempt + 1}/{max_retries}...")
-                await asyncio.sleep(2 ** attempt)
+                return await func()
             except Exception as e:
-                last_exception = ProviderError(f"Unexpected error: {e}")
-                logger.error(f"❌ Errore inaspettato: {e}")
-                break
-        
+                wrapper_cls = _RETRYABLE_EXC.get(type(e))
+
+                if wrapper_cls is not None:
+                    last_exception = wrapper_cls(str(e))
+                elif isinstance(e, APIError):
+                    # Non ritentare per errori di validazione (4xx)
+                    if hasattr(e, 'status_code') and 400 <= e.status_code < 500:
+                        raise ProviderError(f"Client error: {e}") from None
+                    last_exception = ProviderError(f"API error: {e}")
+                else:
+                    last_exception = ProviderError(f"Unexpected error: {e}")
+                    logger.error(f"❌ Errore inaspettato: {e}")
+                    break
+
+                logger.warning(
+                    f"⚠️ {type(e).__name__}, retry {attempt + 1}/{max_retries} "
+                    f"in {backoffs[attempt]}s..."
+                )
+                await asyncio.sleep(backoffs[attempt])
+
         self.error_count += 1
         logger.error(f"❌ Provider {self.name} fallito dopo {max_retries} tentativi")
-        raise last_exception or ProviderError(f"Provider {self.name} non disponibile")
+        # from None: evita di accumulare catene __context__ tra i tentativi
+        raise (last_exception or ProviderError(f"Provider {self.name} non disponibile")) from None
     
+    async def _pump_stream(self, source: AsyncIterator[str], queue: "asyncio.Queue"):
+        """Leggi i chunk dalla sorgente e accodali; None segnala EOF"""
+        try:
+            async for chunk in source:
+                await queue.put(chunk)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    async def _buffered_stream(self, source: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Disaccoppia il reader HTTP dal consumer con una coda limitata:
+        un consumer lento non backpressura il socket e un consumer veloce
+        non stalla sul flush
+
+        Args:
+            source: Async iterator dei chunk di risposta
+
+        Yields:
+            Chunk di risposta
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.STREAM_QUEUE_SIZE)
+        reader = asyncio.create_task(self._pump_stream(source, queue))
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            reader.cancel()
+
     def get_stats(self) -> Dict[str, Any]:
         """Ottieni statistiche del provider"""
         return {"name": self.name}
@@ -110,21 +173,21 @@ class BaseProvider(ABC):
 class DeepSeekProvider(BaseProvider):
     def __init__(self, config: ProviderConfig):
         super().__init__(config)
-        self.client = OpenAI(
+        # Client async: non blocca l'event loop durante l'HTTP round-trip
+        self.client = AsyncOpenAI(
             api_key=config.api_key,
             base_url=config.base_url,
             timeout=config.timeout
         )
-    
+
     async def chat(self, messages: List[Message], params: GenerationParams = None) -> AIResponse:
         if params is None:
             params = GenerationParams(model=self.config.default_model)
-        
+
         async def _call():
-            # Converti i messaggi nel formato OpenAI
-            api_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
-            
-            response = self.client.chat.completions.create(
+            api_messages = _to_api_messages(messages)
+
+            response = await self.client.chat.completions.create(
                 model=params.model,
                 messages=api_messages,
                 max_tokens=params.max_tokens,
@@ -132,12 +195,21 @@ class DeepSeekProvider(BaseProvider):
                 stream=False,
                 tools=params.tools
             )
-            
+
             # Gestisci tool calls se presenti
             tool_calls = None
             if hasattr(response.choices[0].message, 'tool_calls') and response.choices[0].message.tool_calls:
+                # Gli argomenti arrivano come stringa JSON dall'API:
+                # decodificali subito così downstream lavora su dict
                 tool_calls = [
-                    {"name": tc.function.name, "arguments": tc.function.arguments}
+                    {
+                        "name": tc.function.name,
+                        "arguments": (
+                            _json_loads(tc.function.arguments)
+                            if isinstance(tc.function.arguments, str)
+                            else tc.function.arguments
+                        )
+                    }
                     for tc in response.choices[0].message.tool_calls
                 ]
             
@@ -160,22 +232,22 @@ class DeepSeekProvider(BaseProvider):
             params = GenerationParams(model=self.config.default_model)
         
         async def _call():
-            api_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
-            
-            response = self.client.chat.completions.create(
+            api_messages = _to_api_messages(messages)
+
+            response = await self.client.chat.completions.create(
                 model=params.model,
                 messages=api_messages,
                 max_tokens=params.max_tokens,
                 temperature=params.temperature,
                 stream=True
             )
-            
-            for chunk in response:
+
+            async for chunk in response:
                 if chunk.choices[0].delta.content:
                     yield chunk.choices[0].delta.content
-        
+
         try:
-            async for chunk in _call():
+            async for chunk in self._buffered_stream(_call()):
                 yield chunk
         except ProviderError as e:
             logger.error(f"DeepSeek streaming error: {str(e)}")
@@ -186,19 +258,19 @@ class OpenAIProvider(BaseProvider):
     
     def __init__(self, config: ProviderConfig):
         super().__init__(config)
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             api_key=config.api_key,
             timeout=config.timeout
         )
-    
+
     async def chat(self, messages: List[Message], params: GenerationParams = None) -> AIResponse:
         if params is None:
             params = GenerationParams(model="gpt-3.5-turbo")
-        
+
         async def _call():
-            api_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
-            
-            response = self.client.chat.completions.create(
+            api_messages = _to_api_messages(messages)
+
+            response = await self.client.chat.completions.create(
                 model=params.model,
                 messages=api_messages,
                 max_tokens=params.max_tokens,
@@ -225,22 +297,22 @@ class OpenAIProvider(BaseProvider):
             params = GenerationParams(model="gpt-3.5-turbo")
         
         async def _call():
-            api_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
-            
-            response = self.client.chat.completions.create(
+            api_messages = _to_api_messages(messages)
+
+            response = await self.client.chat.completions.create(
                 model=params.model,
                 messages=api_messages,
                 max_tokens=params.max_tokens,
                 temperature=params.temperature,
                 stream=True
             )
-            
-            for chunk in response:
+
+            async for chunk in response:
                 if chunk.choices[0].delta.content:
                     yield chunk.choices[0].delta.content
-        
+
         try:
-            async for chunk in _call():
+            async for chunk in self._buffered_stream(_call()):
                 yield chunk
         except ProviderError as e:
             logger.error(f"OpenAI streaming error: {str(e)}")
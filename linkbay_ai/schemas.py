@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, Any, List, Literal
 from datetime import datetime
 from enum import Enum
@@ -9,6 +9,10 @@ class ProviderType(str, Enum):
     LOCAL = "local"
 
 class ProviderConfig(BaseModel):
+    # Frozen: validazione una sola volta alla costruzione, hashabile,
+    # niente __pydantic_setattr__ sul percorso caldo
+    model_config = ConfigDict(frozen=True)
+
     api_key: str
     base_url: str
     default_model: str = "deepseek-chat"
@@ -17,6 +21,8 @@ class ProviderConfig(BaseModel):
     timeout: int = 30
 
 class GenerationParams(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     model: str
     max_tokens: int = 1000
     stream: bool = False
@@ -24,21 +30,29 @@ class GenerationParams(BaseModel):
     tools: Optional[List[Dict[str, Any]]] = None
 
 class AIRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     prompt: str
     params: Optional[GenerationParams] = None
     context: Optional[Dict[str, Any]] = None
 
 class Message(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     role: Literal["user", "assistant", "system"]
     content: str
     timestamp: datetime = Field(default_factory=datetime.now)
     tokens: Optional[int] = None
 
 class ToolCall(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     name: str
     arguments: Dict[str, Any]
 
 class AIResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     content: str
     model: str
     provider: str
@@ -47,19 +61,26 @@ class AIResponse(BaseModel):
     tool_calls: Optional[List[ToolCall]] = None
 
 class BudgetConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     max_tokens_per_hour: int = 100000
     max_tokens_per_day: int = 1000000
     max_cost_per_hour: float = 10.0  # USD
     alert_threshold: float = 0.8  # 80%
 
 class CacheEntry(BaseModel):
+    # Resta mutabile: hits viene incrementato sui cache hit.
+    # embedding è vuoto di default: la copia autoritativa vive nella
+    # matrice int8 quantizzata del namespace, non per-entry
     query: str
-    embedding: List[float]
+    embedding: List[float] = Field(default_factory=list)
     response: str
     timestamp: datetime = Field(default_factory=datetime.now)
     hits: int = 0
 
 class ConversationConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     max_messages: int = 10
     context_window: int = 4096
     summarize_old_messages: bool = True
\ No newline at end of file
@@ -2,6 +2,7 @@
 Semantic Cache - Cache risposte basata su similarità semantica
 """
 from typing import Optional, List, Dict
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from .schemas import CacheEntry
 import logging
@@ -9,13 +10,62 @@ import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Lazy import: hnswlib è opzionale, sotto questa soglia vince comunque
+# la scansione flat (l'overhead del grafo non si ripaga)
+try:
+    import hnswlib
+    _HNSW_AVAILABLE = True
+except ImportError:
+    hnswlib = None
+    _HNSW_AVAILABLE = False
+
+_HNSW_MIN_ENTRIES = 1024
+
+# Capienza della cache LRU testo -> embedding normalizzato
+_EMBED_CACHE_SIZE = 4096
+
+
+class _NamespaceStore:
+    """Entry, matrice embedding quantizzata e indice HNSW di un namespace"""
+
+    __slots__ = ("entries", "emb_q", "scales", "index", "index_size")
+
+    def __init__(self):
+        self.entries: List[CacheEntry] = []
+        # Matrice (N, D) int8 + scala float32 per riga: 4x meno banda
+        # sulla scansione rispetto a float32, recall quasi identica
+        self.emb_q: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.index = None
+        self.index_size = 0
+
+    def dequantized(self) -> Optional[np.ndarray]:
+        """Ricostruisci la matrice float32 (solo per rebuild dell'indice)"""
+        if self.emb_q is None:
+            return None
+        return self.emb_q.astype(np.float32) * self.scales[:, None]
+
+
+def _quantize(v: np.ndarray):
+    """Quantizza un vettore float32 in (int8, scala per-riga)"""
+    scale = float(np.abs(v).max()) / 127.0
+    if scale == 0.0:
+        scale = 1.0
+    q = np.round(v / scale).astype(np.int8)
+    return q, scale
+
+
 class SemanticCache:
     """
     Cache semantica per evitare chiamate duplicate
     Usa embeddings per trovare query simili
+
+    Le entry sono partizionate per namespace (es. modello + hash dei
+    tool attivi) così una risposta di deepseek-chat non viene mai
+    servita per deepseek-reasoner o con un tool set diverso.
     """
-    
-    def __init__(self, 
+
+    def __init__(self,
                  similarity_threshold: float = 0.95,
                  max_entries: int = 1000,
                  ttl_hours: int = 24):
@@ -28,12 +78,19 @@ class SemanticCache:
         self.threshold = similarity_threshold
         self.max_entries = max_entries
         self.ttl = timedelta(hours=ttl_hours)
-        self.cache: List[CacheEntry] = []
-        
+
+        # Un store per namespace: entry + matrice int8 quantizzata
+        # allineata riga-per-riga
+        self._stores: Dict[str, _NamespaceStore] = {}
+
+        # LRU in-process degli embedding: un retry o una probe ripetuta
+        # sullo stesso prompt non ripaga il forward pass del modello
+        self._embed_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
         # Lazy import per non rendere obbligatorio
         self.model = None
         self._embeddings_available = False
-        
+
         try:
             from sentence_transformers import SentenceTransformer
             self.model = SentenceTransformer('all-MiniLM-L6-v2')
@@ -45,69 +102,255 @@ class SemanticCache:
                 "Cache semantica disabilitata. "
                 "Installa con: pip install sentence-transformers"
             )
-    
-    def _get_embedding(self, text: str) -> Optional[List[float]]:
-        """Genera embedding per il testo"""
+
+    def _get_embedding(self, text: str) -> Optional[np.ndarray]:
+        """Genera embedding L2-normalizzato per il testo (con LRU)"""
         if not self._embeddings_available:
             return None
-        
+
+        cached = self._embed_cache.get(text)
+        if cached is not None:
+            self._embed_cache.move_to_end(text)
+            return cached
+
         try:
             embedding = self.model.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            embedding = embedding.astype(np.float32)
+            norm = np.linalg.norm(embedding)
+            if norm > 0:
+                embedding /= norm
         except Exception as e:
             logger.error(f"Errore generazione embedding: {e}")
             return None
-    
-    def _cosine_similarity(self, emb1: List[float], emb2: List[float]) -> float:
-        """Calcola similarità coseno tra due embeddings"""
-        a = np.array(emb1)
-        b = np.array(emb2)
-        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
-    
+
+        if len(self._embed_cache) >= _EMBED_CACHE_SIZE:
+            self._embed_cache.popitem(last=False)
+        self._embed_cache[text] = embedding
+
+        return embedding
+
+    def _get_embeddings_batch(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        Genera embedding L2-normalizzati per più testi in un solo encode:
+        il batching ammortizza il lancio dei kernel e satura le unità SIMD
+
+        Args:
+            texts: Testi da embeddare
+
+        Returns:
+            Matrice (N, D) float32 normalizzata, None se non disponibile
+        """
+        if not self._embeddings_available or not texts:
+            return None
+
+        # Cattura le righe già in LRU prima degli insert: su batch più
+        # grandi della capienza gli insert evictano chiavi che servono
+        # ancora a questo batch, quindi la matrice non può essere
+        # ricostruita rileggendo la LRU
+        rows = {}
+        for text in texts:
+            cached = self._embed_cache.get(text)
+            if cached is not None:
+                rows[text] = cached
+
+        # Ricalcola solo i testi mancanti (dedup preservando l'ordine)
+        missing = list(dict.fromkeys(t for t in texts if t not in rows))
+
+        if missing:
+            try:
+                batch = self.model.encode(
+                    missing,
+                    batch_size=32,
+                    normalize_embeddings=True,
+                    convert_to_numpy=True
+                ).astype(np.float32)
+            except Exception as e:
+                logger.error(f"Errore generazione embedding batch: {e}")
+                return None
+
+            for text, row in zip(missing, batch):
+                rows[text] = row
+                if len(self._embed_cache) >= _EMBED_CACHE_SIZE:
+                    self._embed_cache.popitem(last=False)
+                self._embed_cache[text] = row
+
+        return np.stack([rows[t] for t in texts])
+
+    async def warm_up(self, pairs: List[tuple], namespace: str = ""):
+        """
+        Pre-popola la cache con coppie (query, risposta) in un solo batch
+
+        Args:
+            pairs: Lista di tuple (query, risposta)
+            namespace: Partizione della cache
+        """
+        if not pairs:
+            return
+
+        queries = [q for q, _ in pairs]
+        matrix = self._get_embeddings_batch(queries)
+        if matrix is None:
+            return
+
+        store = self._stores.get(namespace)
+        if store is None:
+            store = self._stores[namespace] = _NamespaceStore()
+
+        # L'embedding vive solo nella matrice quantizzata del namespace:
+        # niente copia float per-entry
+        now = datetime.now()
+        for query, response in pairs:
+            store.entries.append(CacheEntry(
+                query=query,
+                response=response,
+                timestamp=now,
+                hits=0
+            ))
+
+        # Quantizzazione vettorializzata dell'intero batch
+        batch_scales = np.abs(matrix).max(axis=1) / 127.0
+        batch_scales[batch_scales == 0.0] = 1.0
+        batch_q = np.round(matrix / batch_scales[:, None]).astype(np.int8)
+
+        if store.emb_q is None:
+            store.emb_q = batch_q
+            store.scales = batch_scales.astype(np.float32)
+        else:
+            store.emb_q = np.vstack((store.emb_q, batch_q))
+            store.scales = np.concatenate(
+                (store.scales, batch_scales.astype(np.float32))
+            )
+        self._rebuild_index(store)
+
+        logger.info(f"🔥 Cache pre-popolata con {len(pairs)} entry")
+
+    def _total_entries(self) -> int:
+        """Numero totale di entry su tutti i namespace"""
+        return sum(len(store.entries) for store in self._stores.values())
+
+    def _select_entries(self, store: _NamespaceStore, keep: List[int]):
+        """Mantieni solo le entry agli indici dati (cache + matrice allineate)"""
+        if len(keep) == len(store.entries):
+            return
+
+        store.entries = [store.entries[i] for i in keep]
+        if store.emb_q is not None:
+            if keep:
+                store.emb_q = store.emb_q[keep]
+                store.scales = store.scales[keep]
+            else:
+                store.emb_q = None
+                store.scales = None
+        self._rebuild_index(store)
+
+    def _rebuild_index(self, store: _NamespaceStore):
+        """Ricostruisci l'indice HNSW dalla matrice degli embedding"""
+        store.index = None
+        store.index_size = 0
+
+        if not _HNSW_AVAILABLE or store.emb_q is None:
+            return
+        if len(store.entries) < _HNSW_MIN_ENTRIES:
+            return
+
+        embeddings = store.dequantized()
+        dim = embeddings.shape[1]
+        index = hnswlib.Index(space='ip', dim=dim)
+        index.init_index(
+            max_elements=max(self.max_entries, len(store.entries)),
+            ef_construction=200,
+            M=16
+        )
+        index.add_items(embeddings, np.arange(len(store.entries)))
+        store.index = index
+        store.index_size = len(store.entries)
+
+    def _index_add(self, store: _NamespaceStore, embedding: np.ndarray):
+        """Aggiungi incrementalmente l'ultima riga all'indice HNSW"""
+        if not _HNSW_AVAILABLE:
+            return
+
+        if store.index is None:
+            # Costruisci solo una volta superata la soglia
+            if len(store.entries) >= _HNSW_MIN_ENTRIES:
+                self._rebuild_index(store)
+            return
+
+        if store.index_size >= store.index.get_max_elements():
+            self._rebuild_index(store)
+            return
+
+        store.index.add_items(embedding.reshape(1, -1), [len(store.entries) - 1])
+        store.index_size += 1
+
     def _cleanup_old_entries(self):
         """Rimuovi entry scadute"""
         now = datetime.now()
-        self.cache = [
-            entry for entry in self.cache
-            if now - entry.timestamp < self.ttl
-        ]
-        
-        # Se ancora troppo pieno, rimuovi i meno usati
-        if len(self.cache) > self.max_entries:
-            self.cache.sort(key=lambda x: x.hits, reverse=True)
-            self.cache = self.cache[:self.max_entries]
-    
-    async def get_cached_response(self, query: str) -> Optional[str]:
+
+        for store in self._stores.values():
+            keep = [
+                i for i, entry in enumerate(store.entries)
+                if now - entry.timestamp < self.ttl
+            ]
+            self._select_entries(store, keep)
+
+            # Se ancora troppo pieno, rimuovi i meno usati
+            if len(store.entries) > self.max_entries:
+                by_hits = sorted(
+                    range(len(store.entries)),
+                    key=lambda i: store.entries[i].hits,
+                    reverse=True
+                )
+                self._select_entries(store, sorted(by_hits[:self.max_entries]))
+
+        # Elimina i namespace rimasti vuoti
+        self._stores = {
+            ns: store for ns, store in self._stores.items() if store.entries
+        }
+
+    async def get_cached_response(self, query: str, namespace: str = "") -> Optional[str]:
         """
         Cerca una risposta cached per query simili
-        
+
         Args:
             query: Query da cercare
-            
+            namespace: Partizione della cache (es. "modello|tool_hash")
+
         Returns:
             Risposta cached se trovata, altrimenti None
         """
         if not self._embeddings_available:
             return None
-        
+
         self._cleanup_old_entries()
-        
+
+        store = self._stores.get(namespace)
+        if store is None or store.emb_q is None:
+            return None
+
         # Genera embedding per la query
         query_embedding = self._get_embedding(query)
         if query_embedding is None:
             return None
-        
-        # Cerca entry simili
+
+        if store.index is not None:
+            # Traversata HNSW: visita ~O(log N) vettori invece di tutti
+            labels, dists = store.index.knn_query(query_embedding, k=1)
+            best_idx = int(labels[0][0])
+            best_similarity = 1.0 - float(dists[0][0])
+        else:
+            # GEMV int8 con accumulo int32 sulla matrice quantizzata,
+            # poi rescale per-riga: 4x meno banda di una scansione float32
+            qq, qscale = _quantize(query_embedding)
+            raw = store.emb_q.astype(np.int32) @ qq.astype(np.int32)
+            scores = raw * (store.scales * qscale)
+            best_idx = int(scores.argmax())
+            best_similarity = float(scores[best_idx])
+
         best_match = None
-        best_similarity = 0.0
-        
-        for entry in self.cache:
-            similarity = self._cosine_similarity(query_embedding, entry.embedding)
-            
-            if similarity > best_similarity and similarity >= self.threshold:
-                best_similarity = similarity
-                best_match = entry
-        
+        if best_similarity >= self.threshold:
+            best_match = store.entries[best_idx]
+
         if best_match:
             # Aggiorna contatore hit
             best_match.hits += 1
@@ -116,59 +359,81 @@ class SemanticCache:
                 f"Hits totali: {best_match.hits}"
             )
             return best_match.response
-        
+
         logger.debug(f"❌ Cache MISS (best similarity: {best_similarity:.3f})")
         return None
-    
-    async def cache_response(self, query: str, response: str):
+
+    async def cache_response(self, query: str, response: str, namespace: str = ""):
         """
         Salva una risposta in cache
-        
+
         Args:
             query: Query originale
             response: Risposta da cachare
+            namespace: Partizione della cache (es. "modello|tool_hash")
         """
         if not self._embeddings_available:
             return
-        
+
         embedding = self._get_embedding(query)
         if embedding is None:
             return
-        
+
+        # L'embedding vive solo nella matrice quantizzata del namespace:
+        # niente copia float per-entry
         entry = CacheEntry(
             query=query,
-            embedding=embedding,
             response=response,
             timestamp=datetime.now(),
             hits=0
         )
-        
-        self.cache.append(entry)
-        logger.debug(f"💾 Risposta cachata | Cache size: {len(self.cache)}")
-    
+
+        store = self._stores.get(namespace)
+        if store is None:
+            store = self._stores[namespace] = _NamespaceStore()
+
+        store.entries.append(entry)
+        q, scale = _quantize(embedding)
+        row = q.reshape(1, -1)
+        if store.emb_q is None:
+            store.emb_q = row
+            store.scales = np.array([scale], dtype=np.float32)
+        else:
+            store.emb_q = np.vstack((store.emb_q, row))
+            store.scales = np.append(store.scales, np.float32(scale))
+        self._index_add(store, embedding)
+
+        logger.debug(f"💾 Risposta cachata | Cache size: {self._total_entries()}")
+
     def get_stats(self) -> Dict:
         """Ottieni statistiche cache"""
-        if not self.cache:
+        size = self._total_entries()
+        if not size:
             return {
                 "size": 0,
                 "total_hits": 0,
                 "avg_hits": 0,
                 "enabled": self._embeddings_available
             }
-        
-        total_hits = sum(entry.hits for entry in self.cache)
-        
+
+        total_hits = sum(
+            entry.hits
+            for store in self._stores.values()
+            for entry in store.entries
+        )
+
         return {
-            "size": len(self.cache),
+            "size": size,
             "max_size": self.max_entries,
+            "namespaces": len(self._stores),
             "total_hits": total_hits,
-            "avg_hits": total_hits / len(self.cache),
+            "avg_hits": total_hits / size,
             "threshold": self.threshold,
             "ttl_hours": self.ttl.total_seconds() / 3600,
             "enabled": self._embeddings_available
         }
-    
+
     def clear_cache(self):
         """Svuota completamente la cache"""
-        self.cache.clear()
+        self._stores.clear()
         logger.info("🗑️ Cache svuotata")
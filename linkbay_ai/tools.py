@@ -1,13 +1,235 @@
 """
 Tools Manager - Function calling e tool execution
 """
-from typing import Dict, Any, Callable, List, Optional
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from .schemas import ToolCall
+import ast
+import asyncio
+import copy
+import functools
+import inspect
 import logging
+import logging.handlers
 import json
+import operator
+import os
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson (parser C SIMD-accelerato) è opzionale: fallback su stdlib
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+    _json_loads = json.loads
+
+# fastjsonschema compila lo schema in bytecode Python una volta sola;
+# senza, si ripiega su un controllo minimale delle chiavi required
+try:
+    import fastjsonschema
+    _FASTJSONSCHEMA_AVAILABLE = True
+except ImportError:
+    _FASTJSONSCHEMA_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Stato del logging asincrono (vedi setup_async_logging): listener,
+# logger strumentato, QueueHandler installato e handler originali
+_log_listener: Optional[logging.handlers.QueueListener] = None
+_log_target: Optional[logging.Logger] = None
+_log_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_log_saved_handlers: List[logging.Handler] = []
+
+
+def setup_async_logging() -> None:
+    """
+    Sposta l'I/O di logging fuori dall'event loop: gli handler diretti
+    vengono sostituiti da un QueueHandler e un QueueListener li esegue
+    su un thread dedicato. Chiamare shutdown_async_logging() in chiusura
+    """
+    global _log_listener, _log_target, _log_queue_handler, _log_saved_handlers
+    if _log_listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    # Gli handler effettivi (quelli del root se il logger non ne ha)
+    # passano al listener; il logger emette solo un put sulla coda
+    target = logger if logger.handlers else logging.getLogger()
+    handlers = list(target.handlers)
+
+    # Nessun handler configurato: il listener drena verso lastResort
+    # (stderr, WARNING+) invece di scartare ogni record in silenzio
+    listener_handlers = handlers or [logging.lastResort]
+
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, *listener_handlers, respect_handler_level=True
+    )
+    for handler in handlers:
+        target.removeHandler(handler)
+
+    _log_target = target
+    _log_queue_handler = logging.handlers.QueueHandler(log_queue)
+    _log_saved_handlers = handlers
+    target.addHandler(_log_queue_handler)
+
+    _log_listener.start()
+    logger.info("📝 Logging asincrono attivato")
+
+
+def shutdown_async_logging() -> None:
+    """
+    Ferma il listener, svuota la coda dei log in sospeso e ripristina
+    gli handler originali: il logging torna sincrono, nessun record
+    finisce su una coda che nessuno svuota
+    """
+    global _log_listener, _log_target, _log_queue_handler, _log_saved_handlers
+    if _log_listener is None:
+        return
+
+    _log_listener.stop()
+
+    _log_target.removeHandler(_log_queue_handler)
+    for handler in _log_saved_handlers:
+        _log_target.addHandler(handler)
+
+    _log_listener = None
+    _log_target = None
+    _log_queue_handler = None
+    _log_saved_handlers = []
+
+
+def configure_default_executor(loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    """
+    Dimensiona l'executor di default dell'event loop per i tool CPU-bound
+    eseguiti via asyncio.to_thread. Il numero di worker si controlla con
+    la variabile d'ambiente LINKBAY_THREAD_POOL_SIZE (default: 16).
+    Chiamare all'avvio dell'applicazione
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    workers = int(os.getenv("LINKBAY_THREAD_POOL_SIZE", "16"))
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=workers))
+    logger.info("🧵 Thread pool di default: %d worker", workers)
+
+# Whitelist per le espressioni matematiche, compilata una volta sola
+_CALC_RE = re.compile(r'^[\d\s+\-*/().]+$')
+
+# Operatori ammessi dal valutatore AST di calculate
+_CALC_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+def _ttl_memoize(ttl: float, maxsize: int = 1024):
+    """
+    Memoizza una coroutine per TTL secondi, chiave = argomenti.
+
+    I tool deterministici (ricerca, meteo, info utente) vengono spesso
+    richiamati con gli stessi argomenti nello stesso dialogo: il secondo
+    hit diventa un lookup in dict invece di un round-trip upstream.
+
+    La cache è un LRU limitato a maxsize entry: le scadute vengono
+    scartate al lookup, le meno recenti espulse all'inserimento, così
+    chiavi arbitrarie (es. user_id) non crescono senza limite. I valori
+    sono restituiti come copia profonda per evitare che un chiamante
+    che muta il risultato avveleni la cache. Le eccezioni non vengono
+    mai cachate
+
+    Args:
+        ttl: Secondi di validità di un risultato cachato
+        maxsize: Numero massimo di entry residenti
+    """
+    def decorator(func):
+        cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+
+            hit = cache.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    cache.move_to_end(key)
+                    return copy.deepcopy(hit[1])
+                del cache[key]
+
+            result = await func(*args, **kwargs)
+            while len(cache) >= maxsize:
+                cache.popitem(last=False)
+            cache[key] = (now + ttl, copy.deepcopy(result))
+            return result
+
+        def cache_bust():
+            """Svuota la cache del tool"""
+            cache.clear()
+
+        wrapper.cache_bust = cache_bust
+        return wrapper
+
+    return decorator
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_expr(expression: str) -> ast.expr:
+    """Parsa l'espressione una sola volta per formula distinta"""
+    return ast.parse(expression, mode="eval").body
+
+
+def _eval_node(node: ast.expr) -> float:
+    """Valuta un nodo AST ammettendo solo aritmetica su costanti numeriche"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+
+    if isinstance(node, ast.BinOp):
+        op = _CALC_OPS.get(type(node.op))
+        if op is not None:
+            return op(_eval_node(node.left), _eval_node(node.right))
+
+    if isinstance(node, ast.UnaryOp):
+        op = _CALC_OPS.get(type(node.op))
+        if op is not None:
+            return op(_eval_node(node.operand))
+
+    raise ValueError(f"Espressione non consentita: {type(node).__name__}")
+
+
+def _eval(expression: str) -> float:
+    """
+    Valuta un'espressione matematica (sincrona, CPU-bound).
+
+    Eseguita via asyncio.to_thread da CommonTools.calculate così gli
+    alberi di espressione profondi non bloccano l'event loop
+
+    Raises:
+        ValueError: Se l'espressione non è valida
+    """
+    if not expression or not expression.strip():
+        raise ValueError("Espressione matematica obbligatoria")
+
+    try:
+        # Consenti solo operatori matematici e numeri: il parse è
+        # memoizzato per formula, la valutazione cammina solo l'AST
+        if not _CALC_RE.match(expression):
+            raise ValueError("Espressione contiene caratteri non consentiti")
+
+        return float(_eval_node(_compile_expr(expression)))
+    except Exception as e:
+        raise ValueError(f"Espressione non valida: {e}")
+
 class ToolExecutionError(Exception):
     """Errore durante l'esecuzione di un tool"""
     pass
@@ -20,6 +242,60 @@ class ToolNotFoundError(ToolExecutionError):
     """Tool non trovato nel registry"""
     pass
 
+def _build_validator(parameters: Dict[str, Any]) -> Optional[Callable]:
+    """
+    Costruisci un validatore per lo schema dei parametri di un tool.
+
+    Con fastjsonschema lo schema viene compilato in una funzione
+    Python; il fallback verifica solo la presenza delle chiavi required
+
+    Args:
+        parameters: JSON Schema dei parametri
+
+    Returns:
+        Callable che solleva ToolValidationError su argomenti invalidi,
+        oppure None se non c'è nulla da validare
+    """
+    if not parameters:
+        return None
+
+    if _FASTJSONSCHEMA_AVAILABLE:
+        compiled = fastjsonschema.compile(parameters)
+
+        def validate(arguments: Dict[str, Any]):
+            try:
+                compiled(arguments)
+            except fastjsonschema.JsonSchemaValueException as e:
+                raise ToolValidationError(str(e)) from None
+
+        return validate
+
+    required = tuple(parameters.get("required", ()))
+    if not required:
+        return None
+
+    def validate(arguments: Dict[str, Any]):
+        for key in required:
+            if key not in arguments:
+                raise ToolValidationError(f"Parametro obbligatorio mancante: {key}")
+
+    return validate
+
+
+@dataclass(slots=True)
+class ToolEntry:
+    """Un tool registrato: callable e definizione in un'unica struttura"""
+    name: str
+    fn: Callable
+    definition: Dict[str, Any]
+    validator: Optional[Callable] = None
+
+    # Convenzione di chiamata posizionale ricavata dalla firma alla
+    # registrazione: None => fallback a **kwargs
+    param_names: Optional[Tuple[str, ...]] = None
+    defaults: Dict[str, Any] = field(default_factory=dict)
+
+
 class ToolsManager:
     """
     Gestisce la registrazione ed esecuzione di tools/functions
@@ -27,8 +303,24 @@ class ToolsManager:
     """
     
     def __init__(self):
+        # Registry unificato nome -> ToolEntry (slots, ordinato per
+        # inserimento): un solo lookup per dispatch invece di due
+        # container paralleli
+        self._entries: Dict[str, ToolEntry] = {}
+
+        # Viste derivate mantenute per compatibilità: aggiornate solo
+        # alla registrazione, mai ricostruite sul percorso di chiamata
         self.tools: Dict[str, Callable] = {}
         self.tool_definitions: List[Dict[str, Any]] = []
+
+        # Indice nome -> posizione in tool_definitions: la
+        # ri-registrazione sovrascrive in place invece di accumulare
+        # definizioni duplicate negli orchestratori a vita lunga
+        self._def_index: Dict[str, int] = {}
+
+        # JSON delle definizioni precomputato: invalidato solo alla
+        # registrazione, così il request path copia un buffer bytes
+        self._defs_json: Optional[bytes] = None
     
     def register_tool(
         self,
@@ -46,8 +338,6 @@ class ToolsManager:
             description: Descrizione del tool
             parameters: JSON Schema dei parametri
         """
-        self.tools[name] = function
-        
         # Crea definizione in formato OpenAI
         tool_def = {
             "type": "function",
@@ -57,13 +347,87 @@ class ToolsManager:
                 "parameters": parameters
             }
         }
-        
-        self.tool_definitions.append(tool_def)
-        logger.info(f"🔧 Tool registrato: {name}")
+
+        self._register_prebuilt(name, function, tool_def)
+
+    def _register_prebuilt(
+        self,
+        name: str,
+        function: Callable,
+        tool_def: Dict[str, Any]
+    ):
+        """Registra un tool con definizione già nel formato OpenAI"""
+        # Ispeziona la firma una volta sola: il dispatch diventa
+        # posizionale, niente espansione dict->kwargs per chiamata.
+        # Solo per firme interamente posizionali: keyword-only,
+        # *args e **kwargs restano sul percorso keyword
+        param_names = None
+        defaults = {}
+        try:
+            sig = inspect.signature(function)
+            positional_kinds = (
+                inspect.Parameter.POSITIONAL_ONLY,
+                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+            )
+            if all(p.kind in positional_kinds for p in sig.parameters.values()):
+                param_names = tuple(sig.parameters)
+                defaults = {
+                    k: p.default
+                    for k, p in sig.parameters.items()
+                    if p.default is not inspect.Parameter.empty
+                }
+        except (TypeError, ValueError):
+            pass
+
+        self._entries[name] = ToolEntry(
+            name=name,
+            fn=function,
+            definition=tool_def,
+            validator=_build_validator(tool_def["function"].get("parameters") or {}),
+            param_names=param_names,
+            defaults=defaults
+        )
+
+        # Aggiorna le viste derivate
+        self.tools[name] = function
+        idx = self._def_index.get(name)
+        if idx is None:
+            self._def_index[name] = len(self.tool_definitions)
+            self.tool_definitions.append(tool_def)
+        else:
+            self.tool_definitions[idx] = tool_def
+
+        self._defs_json = None
+        logger.info("🔧 Tool registrato: %s", name)
     
+    @staticmethod
+    def _positional_args(entry: ToolEntry, arguments: Dict[str, Any]) -> tuple:
+        """Costruisci la tupla posizionale dagli argomenti del tool call"""
+        defaults = entry.defaults
+        args = []
+        for param in entry.param_names:
+            if param in arguments:
+                args.append(arguments[param])
+            elif param in defaults:
+                args.append(defaults[param])
+            else:
+                raise ToolValidationError(
+                    f"Parametro obbligatorio mancante: {param}"
+                )
+        return tuple(args)
+
     def get_tool_definitions(self) -> List[Dict[str, Any]]:
         """Ottieni le definizioni dei tools per l'API"""
         return self.tool_definitions
+
+    def get_tool_definitions_json(self) -> bytes:
+        """
+        Ottieni le definizioni serializzate in JSON (bytes).
+        Il blob è cachato e rigenerato solo dopo una registrazione
+        """
+        if self._defs_json is None:
+            self._defs_json = _json_dumps(self.tool_definitions)
+        return self._defs_json
     
     async def execute_tool(self, tool_call: ToolCall) -> Any:
         """
@@ -78,26 +442,117 @@ class ToolsManager:
         Raises:
             ToolExecutionError: Se l'esecuzione fallisce
         """
-        if tool_call.name not in self.tools:
-            raise ToolExecutionError(f"Tool non trovato: {tool_call.name}")
-        
+        # Un solo hash sul nome invece di "in" + subscript
+        entry = self._entries.get(tool_call.name)
+        if entry is None:
+            raise ToolNotFoundError(f"Tool non trovato: {tool_call.name}")
+        function = entry.fn
+
+        # Difesa: alcuni provider consegnano gli argomenti ancora come
+        # stringa JSON; decodifica con il parser più veloce disponibile
+        arguments = tool_call.arguments
+        if isinstance(arguments, str):
+            arguments = _json_loads(arguments)
+
+        # Valida contro lo schema registrato: l'output malformato
+        # dell'LLM fallisce qui, non in fondo al corpo del tool
+        if entry.validator is not None:
+            entry.validator(arguments)
+
+        # Tupla posizionale costruita fuori dal try: un parametro
+        # mancante deve arrivare al chiamante come ToolValidationError,
+        # non ri-incartato in ToolExecutionError
+        pos_args = (
+            self._positional_args(entry, arguments)
+            if entry.param_names is not None else None
+        )
+
+        # Formattazione lazy: il messaggio viene materializzato solo
+        # se il livello INFO è effettivamente abilitato
+        log_info = logger.isEnabledFor(logging.INFO)
+
         try:
-            function = self.tools[tool_call.name]
-            
             # Esegui la funzione
-            logger.info(f"🔧 Esecuzione tool: {tool_call.name}")
-            result = await function(**tool_call.arguments)
-            
-            logger.info(f"✅ Tool eseguito con successo: {tool_call.name}")
+            if log_info:
+                logger.info("🔧 Esecuzione tool: %s", tool_call.name)
+
+            if pos_args is not None:
+                # Dispatch posizionale nell'ordine della firma;
+                # gli argomenti extra dell'LLM vengono ignorati
+                result = await function(*pos_args)
+            else:
+                result = await function(**arguments)
+
+            if log_info:
+                logger.info("✅ Tool eseguito con successo: %s", tool_call.name)
             return result
-            
+
         except Exception as e:
-            logger.error(f"❌ Errore esecuzione tool {tool_call.name}: {e}")
+            logger.error("❌ Errore esecuzione tool %s: %s", tool_call.name, e)
             raise ToolExecutionError(f"Errore esecuzione {tool_call.name}: {str(e)}")
     
+    def _bulk_dispatch(self, tool_calls: List[ToolCall]) -> List:
+        """
+        Crea le coroutine di esecuzione per un batch di tool call.
+
+        Il lookup viene legato a locali prima del loop: su batch di tool
+        brevi l'overhead per chiamata scende sensibilmente (niente
+        LOAD_ATTR ripetuti nel ciclo)
+
+        Args:
+            tool_calls: Tool call da dispatchare
+
+        Returns:
+            Lista di coroutine, una per tool call, da passare a gather
+        """
+        execute = self.execute_tool
+        return [execute(tc) for tc in tool_calls]
+
+    async def execute_tools(self, tool_calls: List[ToolCall]) -> List[Dict[str, Any]]:
+        """
+        Esegui più tool call in parallelo
+
+        Le tool call di uno stesso turno LLM sono indipendenti: con
+        asyncio.gather le latenze I/O si sovrappongono invece di
+        sommarsi, e un fallimento non interrompe il batch
+
+        Args:
+            tool_calls: Tool call da eseguire
+
+        Returns:
+            Lista di dict {"name", "ok", "result"|"error"}, nello stesso
+            ordine delle tool call
+        """
+        outcomes = await asyncio.gather(
+            *self._bulk_dispatch(tool_calls),
+            return_exceptions=True
+        )
+
+        results = []
+        for tc, outcome in zip(tool_calls, outcomes):
+            if isinstance(outcome, Exception):
+                results.append({"name": tc.name, "ok": False, "error": str(outcome)})
+            else:
+                results.append({"name": tc.name, "ok": True, "result": outcome})
+        return results
+
     def list_tools(self) -> List[str]:
         """Lista tutti i tool disponibili"""
-        return list(self.tools.keys())
+        return list(self._entries.keys())
+
+
+def _columns_to_records(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Converti colonne (SoA) in lista di record (AoS) per il JSON finale
+
+    Args:
+        columns: Dict colonna -> lista di valori, tutte della stessa lunghezza
+
+    Returns:
+        Lista di dict, uno per riga
+    """
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
 
 
 # ============= TOOLS PREDEFINITI =============
@@ -106,6 +561,7 @@ class CommonTools:
     """Collezione di tools comuni predefiniti"""
     
     @staticmethod
+    @_ttl_memoize(ttl=60)
     async def search_products(query: str, category: Optional[str] = None, max_results: int = 10) -> List[Dict]:
         """
         Cerca prodotti nel catalogo
@@ -125,19 +581,22 @@ class CommonTools:
             raise ValueError("Query di ricerca obbligatoria")
         if max_results < 1 or max_results > 100:
             raise ValueError("max_results deve essere tra 1 e 100")
-        
-        # Implementazione mock - connetti al tuo database
-        logger.info(f"🔍 Ricerca prodotti: {query} (categoria: {category})")
-        return [
-            {
-                "id": 1,
-                "name": f"Prodotto per {query}",
-                "price": 99.99,
-                "category": category or "generale"
-            }
-        ]
+
+        # Implementazione mock - connetti al tuo database.
+        # Internamente si lavora per colonne (SoA): su un catalogo reale
+        # le colonne stanno in cache e si filtrano in blocco, i record
+        # vengono materializzati solo al confine LLM
+        logger.info("🔍 Ricerca prodotti: %s (categoria: %s)", query, category)
+        columns = {
+            "id": [1],
+            "name": [f"Prodotto per {query}"],
+            "price": [99.99],
+            "category": [category or "generale"],
+        }
+        return _columns_to_records(columns)
     
     @staticmethod
+    @_ttl_memoize(ttl=60)
     async def get_weather(location: str) -> Dict[str, Any]:
         """
         Ottieni meteo per una località
@@ -148,7 +607,7 @@ class CommonTools:
         Returns:
             Dati meteo
         """
-        logger.info(f"🌤️ Richiesta meteo per: {location}")
+        logger.info("🌤️ Richiesta meteo per: %s", location)
         # Implementazione mock - usa API meteo reale
         return {
             "location": location,
@@ -171,22 +630,12 @@ class CommonTools:
         Raises:
             ValueError: Se l'espressione non è valida
         """
-        if not expression or not expression.strip():
-            raise ValueError("Espressione matematica obbligatoria")
-        
-        logger.info(f"🔢 Calcolo: {expression}")
-        try:
-            # Safe eval: consenti solo operatori matematici e numeri
-            import re
-            if not re.match(r'^[\d\s\+\-\*\/\(\)\.]+$', expression):
-                raise ValueError("Espressione contiene caratteri non consentiti")
-            
-            result = eval(expression, {"__builtins__": {}}, {})
-            return float(result)
-        except Exception as e:
-            raise ValueError(f"Espressione non valida: {e}")
+        logger.info("🔢 Calcolo: %s", expression)
+        # CPU-bound: delega al thread pool, l'event loop resta libero
+        return await asyncio.to_thread(_eval, expression)
     
     @staticmethod
+    @_ttl_memoize(ttl=60)
     async def get_user_info(user_id: str) -> Dict[str, Any]:
         """
         Ottieni informazioni utente
@@ -197,7 +646,7 @@ class CommonTools:
         Returns:
             Dati utente
         """
-        logger.info(f"👤 Richiesta info utente: {user_id}")
+        logger.info("👤 Richiesta info utente: %s", user_id)
         # Implementazione mock - connetti al tuo database
         return {
             "user_id": user_id,
@@ -219,123 +668,170 @@ class CommonTools:
         Returns:
             True se inviato con successo
         """
-        logger.info(f"📧 Invio notifica a {user_id} via {channel}")
+        logger.info("📧 Invio notifica a %s via %s", user_id, channel)
         # Implementazione mock - usa servizio notifiche reale
         return True
 
 
-def create_default_tools_manager() -> ToolsManager:
-    """
-    Crea un ToolsManager con i tools comuni preregistrati
-    
-    Returns:
-        ToolsManager configurato
-    """
-    manager = ToolsManager()
-    
-    # Registra search_products
-    manager.register_tool(
-        name="search_products",
-        function=CommonTools.search_products,
-        description="Cerca prodotti nel catalogo e-commerce",
-        parameters={
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": "Query di ricerca per i prodotti"
-                },
-                "category": {
-                    "type": "string",
-                    "description": "Categoria prodotti (opzionale)"
-                },
-                "max_results": {
-                    "type": "integer",
-                    "description": "Numero massimo risultati",
-                    "default": 10
+# Definizioni dei tool predefiniti (nome, funzione, definizione OpenAI),
+# costruite una volta sola a import time: ogni orchestratore le registra
+# per riferimento invece di riallocare i dict annidati
+_TOOL_DEFS = (
+    (
+        "search_products",
+        CommonTools.search_products,
+        {
+            "type": "function",
+            "function": {
+                "name": "search_products",
+                "description": "Cerca prodotti nel catalogo e-commerce",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "Query di ricerca per i prodotti"
+                        },
+                        "category": {
+                            "type": "string",
+                            "description": "Categoria prodotti (opzionale)"
+                        },
+                        "max_results": {
+                            "type": "integer",
+                            "description": "Numero massimo risultati",
+                            "default": 10
+                        }
+                    },
+                    "required": ["query"]
                 }
-            },
-            "required": ["query"]
+            }
         }
-    )
-    
-    # Registra get_weather
-    manager.register_tool(
-        name="get_weather",
-        function=CommonTools.get_weather,
-        description="Ottieni le previsioni meteo per una località",
-        parameters={
-            "type": "object",
-            "properties": {
-                "location": {
-                    "type": "string",
-                    "description": "Nome della località"
+    ),
+    (
+        "get_weather",
+        CommonTools.get_weather,
+        {
+            "type": "function",
+            "function": {
+                "name": "get_weather",
+                "description": "Ottieni le previsioni meteo per una località",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "location": {
+                            "type": "string",
+                            "description": "Nome della località"
+                        }
+                    },
+                    "required": ["location"]
                 }
-            },
-            "required": ["location"]
+            }
         }
-    )
-    
-    # Registra calculate
-    manager.register_tool(
-        name="calculate",
-        function=CommonTools.calculate,
-        description="Calcola un'espressione matematica",
-        parameters={
-            "type": "object",
-            "properties": {
-                "expression": {
-                    "type": "string",
-                    "description": "Espressione matematica da calcolare (es: '2 + 2 * 3')"
+    ),
+    (
+        "calculate",
+        CommonTools.calculate,
+        {
+            "type": "function",
+            "function": {
+                "name": "calculate",
+                "description": "Calcola un'espressione matematica",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "expression": {
+                            "type": "string",
+                            "description": "Espressione matematica da calcolare (es: '2 + 2 * 3')"
+                        }
+                    },
+                    "required": ["expression"]
                 }
-            },
-            "required": ["expression"]
+            }
         }
-    )
-    
-    # Registra get_user_info
-    manager.register_tool(
-        name="get_user_info",
-        function=CommonTools.get_user_info,
-        description="Ottieni informazioni su un utente",
-        parameters={
-            "type": "object",
-            "properties": {
-                "user_id": {
-                    "type": "string",
-                    "description": "ID dell'utente"
+    ),
+    (
+        "get_user_info",
+        CommonTools.get_user_info,
+        {
+            "type": "function",
+            "function": {
+                "name": "get_user_info",
+                "description": "Ottieni informazioni su un utente",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "user_id": {
+                            "type": "string",
+                            "description": "ID dell'utente"
+                        }
+                    },
+                    "required": ["user_id"]
                 }
-            },
-            "required": ["user_id"]
+            }
         }
-    )
-    
-    # Registra send_notification
-    manager.register_tool(
-        name="send_notification",
-        function=CommonTools.send_notification,
-        description="Invia una notifica a un utente via email/sms/push",
-        parameters={
-            "type": "object",
-            "properties": {
-                "user_id": {
-                    "type": "string",
-                    "description": "ID dell'utente destinatario"
-                },
-                "message": {
-                    "type": "string",
-                    "description": "Contenuto del messaggio"
-                },
-                "channel": {
-                    "type": "string",
-                    "enum": ["email", "sms", "push"],
-                    "description": "Canale di notifica",
-                    "default": "email"
+    ),
+    (
+        "send_notification",
+        CommonTools.send_notification,
+        {
+            "type": "function",
+            "function": {
+                "name": "send_notification",
+                "description": "Invia una notifica a un utente via email/sms/push",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "user_id": {
+                            "type": "string",
+                            "description": "ID dell'utente destinatario"
+                        },
+                        "message": {
+                            "type": "string",
+                            "description": "Contenuto del messaggio"
+                        },
+                        "channel": {
+                            "type": "string",
+                            "enum": ["email", "sms", "push"],
+                            "description": "Canale di notifica",
+                            "default": "email"
+                        }
+                    },
+                    "required": ["user_id", "message"]
                 }
-            },
-            "required": ["user_id", "message"]
+            }
         }
-    )
-    
-    logger.info(f"✅ ToolsManager creato con {len(manager.list_tools())} tools")
+    ),
+)
+
+
+def create_default_tools_manager() -> ToolsManager:
+    """
+    Crea un ToolsManager con i tools comuni preregistrati
+
+    Returns:
+        ToolsManager configurato
+    """
+    manager = ToolsManager()
+
+    # Le definizioni sono precostruite a livello di modulo:
+    # registrazione per riferimento, niente allocazioni ripetute
+    for name, function, tool_def in _TOOL_DEFS:
+        manager._register_prebuilt(name, function, tool_def)
+
+    logger.info("✅ ToolsManager creato con %d tools", len(manager.list_tools()))
     return manager
+
+
+@functools.cache
+def get_default_tools_manager() -> ToolsManager:
+    """
+    Ottieni il ToolsManager di default condiviso del processo.
+
+    L'istanza è creata una sola volta e riusata: adatta quando i tool
+    di default bastano e non si registrano tool per-orchestratore.
+    Per un'istanza isolata e mutabile usare create_default_tools_manager()
+
+    Returns:
+        ToolsManager condiviso con i tools comuni
+    """
+    return create_default_tools_manager()
@@ -1,5 +1,13 @@
 from .core import AIOrchestrator
 from typing import Dict, Any, List
+import json
+
+# orjson (parser C SIMD-accelerato) è opzionale: fallback su stdlib
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 async def generate_html_tailwind(ai: AIOrchestrator, description: str) -> str:
     """Genera HTML Tailwind usando il modello chat rapido."""
@@ -51,8 +59,7 @@ async def analyze_traffic_data(ai: AIOrchestrator, log_data: str) -> str:
     return response.content
 
 def _parse_json_response(response: str) -> Dict[str, Any]:
-    import json
     try:
-        return json.loads(response.strip())
-    except Exception:
+        return _json_loads(response.strip())
+    except (ValueError, TypeError):
         return {"error": "Failed to parse AI response as JSON", "raw": response.strip()}
\ No newline at end of file